@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+DEFAULT_CACHE_DIR = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                 "sim_video_processor", "audio")
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class PCMAudio:
+    """Mono float32 samples memory-mapped from the cache; slices are views, not copies."""
+    def __init__(self, cache, key: str, samples: np.ndarray, sample_rate: int):
+        self.cache = cache
+        self.key = key
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def slice(self, start: float, end: float):
+        return self.samples[int(start * self.sample_rate): int(end * self.sample_rate)]
+
+    def resampled(self, sample_rate: int):
+        if sample_rate == self.sample_rate:
+            return self
+
+        def resample(samples):
+            import torch
+            import torchaudio
+            return torchaudio.functional.resample(torch.from_numpy(samples), self.sample_rate, sample_rate).numpy()
+
+        return self.cache.load_derived(self, f"{sample_rate}hz", resample, sample_rate)
+
+
+class AudioCache:
+    """Decodes each source file once to 16 kHz mono float32 raw PCM, keyed by the file's sha256.
+
+    Entries are plain .f32 files opened with np.memmap, so repeated runs and concurrent
+    workers share the page cache instead of each decoding and holding their own copy.
+    index.json remembers the hash of each (path, size, mtime) so unchanged videos are not re-read.
+    """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key: str):
+        return os.path.join(self.cache_dir, f"{key}.f32"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _open(self, key: str):
+        data_path, meta_path = self._paths(key)
+        if not os.path.exists(meta_path):
+            return None
+        meta = json.load(open(meta_path))
+        if meta["num_samples"] == 0:
+            samples = np.zeros(0, dtype=np.float32)
+        else:
+            # Copy-on-write: pages stay shared with other readers unless a consumer writes to them
+            samples = np.memmap(data_path, dtype=np.float32, mode="c", shape=(meta["num_samples"],))
+        return PCMAudio(self, key, samples, meta["sample_rate"])
+
+    def _commit(self, key: str, tmp_path: str, sample_rate: int, source: str):
+        data_path, meta_path = self._paths(key)
+        num_samples = os.path.getsize(tmp_path) // np.dtype(np.float32).itemsize
+        # The metadata is written last, so readers never see a partially written entry
+        os.replace(tmp_path, data_path)
+        tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+        json.dump({"sample_rate": sample_rate, "num_samples": num_samples, "source": source},
+                  open(tmp_meta_path, "w+"))
+        os.replace(tmp_meta_path, meta_path)
+        return self._open(key)
+
+    def source_key(self, source_path: str):
+        path = os.path.abspath(source_path)
+        stat = os.stat(path)
+        index_path = os.path.join(self.cache_dir, "index.json")
+        index = json.load(open(index_path)) if os.path.exists(index_path) else {}
+        entry = index.get(path)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        key = file_hash(path)
+        # A concurrent writer may drop this entry, which only costs a re-hash next time
+        index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": key}
+        tmp_index_path = f"{index_path}.{os.getpid()}.tmp"
+        json.dump(index, open(tmp_index_path, "w+"))
+        os.replace(tmp_index_path, index_path)
+        return key
+
+    def load(self, source_path: str):
+        key = self.source_key(source_path)
+        audio = self._open(key)
+        if audio is not None:
+            return audio
+        import imageio_ffmpeg
+        data_path, _ = self._paths(key)
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-nostdin", "-loglevel", "error", "-y",
+                        "-i", source_path, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", tmp_path],
+                       check=True)
+        return self._commit(key, tmp_path, SAMPLE_RATE, os.path.abspath(source_path))
+
+    def load_derived(self, audio: PCMAudio, tag: str, fn, sample_rate: int = None):
+        """Cache fn(audio.samples), e.g. a denoised or resampled version, next to its source."""
+        key = f"{audio.key}-{tag}"
+        derived = self._open(key)
+        if derived is not None:
+            return derived
+        data_path, _ = self._paths(key)
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        np.ascontiguousarray(fn(audio.samples), dtype=np.float32).tofile(tmp_path)
+        return self._commit(key, tmp_path, sample_rate or audio.sample_rate, audio.key)
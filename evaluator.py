@@ -1,6 +1,3 @@
-from pyannote.core import Segment, Timeline, Annotation
-from pyannote.metrics.diarization import DiarizationErrorRate
-from jiwer import wer
 import os
 import json
 
@@ -13,6 +10,8 @@ class Evaluator:
         self.pred_trans_text = pred_trans_text
 
     def compute_diarization(self):
+        from pyannote.core import Segment, Annotation
+        from pyannote.metrics.diarization import DiarizationErrorRate
         reference = Annotation()
         for s in self.ground_truth_dict["segments"]:
             seg = self.ground_truth_dict["segments"][s]
@@ -21,19 +20,20 @@ class Evaluator:
         hypothesis = Annotation()
         for s in self.segment_info_dict:
             seg = self.segment_info_dict[s]
-            if len(seg["speaker_preds"]):
+            if len(seg.get("speaker_preds", [])):
                 hypothesis[Segment(seg["start"],
                                 seg["end"])] = seg["speaker_preds"][0][0]
         metric = DiarizationErrorRate()
         return metric(reference, hypothesis)
     
     def compute_wer(self):
+        from jiwer import wer
         return wer(self.ground_truth_dict["text"],
                    self.pred_trans_text)
 
     def evaluate(self):
         results = {}
-        if "segments" in self.ground_truth_path:
+        if "segments" in self.ground_truth_dict:
             results["diarization"] = self.compute_diarization()
         if "text" in self.ground_truth_dict:
             results["wer"] = self.compute_wer()
@@ -1,84 +1,192 @@
 import os
-from moviepy import VideoFileClip, AudioFileClip
-from end_to_end.whisper_transcribe import transcribe_with_whisper
-from typing import List
+import re
+from end_to_end.whisper_transcribe import transcribe_with_whisper, load_whisper_model
+from end_to_end.inference_backend import CPUBackend
+from end_to_end.audio_cache import AudioCache, DEFAULT_CACHE_DIR, SAMPLE_RATE
+from typing import List, Optional
 import json
 from end_to_end.speaker_match import match_speaker_to_segments
-from moviepy import concatenate_audioclips, AudioFileClip, concatenate_videoclips
-import torchaudio
-import torch
-from noisereduce.torchgate import TorchGate as TG
 import tqdm
 import glob
 
-from speechbrain.inference.speaker import SpeakerRecognition
+# torch, torchaudio, moviepy, noisereduce and speechbrain are imported inside the
+# methods that need them, so that cheap commands (rescore, evaluate, ...) do not
+# pay for loading them.
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    if device is not None:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
 class FileProcessor:
     def __init__(self, file_path: str, segment_dir: str, intermediate_dir: str, 
                  speaker_dict_path: str, denoise: bool = False, denoise_prop: float = 0.1,
-                 verification_threshold: float = 0.25, write_video = True):
+                 verification_threshold: float = 0.25, write_video = True,
+                 device: Optional[str] = None, cpu_backend: Optional[dict] = None,
+                 audio_cache_dir: str = DEFAULT_CACHE_DIR):
         if not os.path.exists(file_path):
             raise FileNotFoundError
         if not os.path.exists(speaker_dict_path):
             raise FileNotFoundError
-        speaker_dict = json.load(open(speaker_dict_path))
+        self.speaker_dict = json.load(open(speaker_dict_path))
         if not os.path.exists(segment_dir):
             os.makedirs(segment_dir)
         if not os.path.exists(intermediate_dir):
             os.makedirs(intermediate_dir)
             os.makedirs(os.path.join(intermediate_dir + "/", "speakers/"))
             os.makedirs(os.path.join(intermediate_dir + "/", "final_merged_speakers/"))
-        device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        if cpu_backend is not None:
+            # Quantized / exported models only run on the CPU
+            device = "cpu"
+            self.backend = CPUBackend(cache_dir=os.path.join(intermediate_dir, "pretrained_models/", "exported/"),
+                                      **cpu_backend)
+        else:
+            self.backend = None
+        self._device = device
         self.video_file_path = file_path
-        assert not self.file_path.endswith(".wav")
-        if not file_path.endswith(".wav"):
-            # Need to write the audio file
-            file_path_wav = os.path.splitext(file_path)[0] + ".wav"
-            if not os.path.exists(file_path_wav):
-                clip = VideoFileClip(file_path)
-                clip.audio.write_audiofile(file_path_wav)
-            self.file_path = file_path_wav
-        if denoise:
-            noisy_speech, sr = torchaudio.load(self.file_path)
-            noisy_speech = noisy_speech.to(device)
-            # Create TorchGating instance
-            tg = TG(sr=sr, nonstationary=True, prop_decrease=denoise_prop).to(device)
-            # Apply Spectral Gate to noisy speech signal
-            enhanced_speech = tg(noisy_speech)
-            dn_file_path_wav = os.path.splitext(file_path)[0] + "_denoised.wav"
-            torchaudio.save(dn_file_path_wav, src=enhanced_speech.cpu(), sample_rate=sr)
-            self.file_path = dn_file_path_wav
+        assert not file_path.endswith(".wav")
+        # Decoded (and denoised) on first access, see the `audio` property
+        self.audio_cache = AudioCache(audio_cache_dir)
+        self._audio = None
+        self.denoise = denoise
+        self.denoise_prop = denoise_prop
         self.segment_dir = segment_dir
         self.intermediate_dir = intermediate_dir
         if os.path.exists(os.path.join(self.intermediate_dir, "speaker_info.json")):
             self.all_speaker_info = json.load(open(os.path.join(self.intermediate_dir, "speaker_info.json")))
         else:
-            self.all_speaker_info = {}
-            for s in speaker_dict:
-                self.all_speaker_info.update({
-                    s: {
-                        "ref_utterances": speaker_dict[s],
-                        "ref_segments": [],
-                        "pred_utterances": [],
-                        "pred_segments": []
-                    }
-                })
+            self.all_speaker_info = self.initial_speaker_info()
         if os.path.exists(os.path.join(self.intermediate_dir, "segment_info.json")):
             self.all_segment_info = json.load(open(os.path.join(self.intermediate_dir, "segment_info.json")))
         else:
             self.all_segment_info = {"segments": {}}
         
-        self.verification = SpeakerRecognition.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb", savedir=f"{self.intermediate_dir}/pretrained_models/spkrec-ecapa-voxceleb", run_opts={"device":"cuda"})
+        # Loaded on first access, see the `verification` property
+        self._verification = None
         self.verification_threshold = verification_threshold
         self.write_video = write_video
         if os.path.exists(os.path.join(self.intermediate_dir, "transcript.txt")):
             self.trans_text = open(os.path.join(self.intermediate_dir, "transcript.txt")).read()
         else:
             self.trans_text = None
+
+    def initial_speaker_info(self):
+        all_speaker_info = {}
+        for s in self.speaker_dict:
+            all_speaker_info.update({
+                s: {
+                    "ref_utterances": self.speaker_dict[s],
+                    "ref_segments": [],
+                    "ref_segment_ids": [],
+                    "pred_utterances": [],
+                    "pred_segments": []
+                }
+            })
+        return all_speaker_info
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            self._device = resolve_device()
+        return self._device
+
+    @property
+    def verification(self):
+        if self._verification is None:
+            self._verification = self.load_verification(self.backend)
+        return self._verification
+
+    def load_whisper(self, backend: Optional[CPUBackend] = None):
+        return load_whisper_model(device=self.device, backend=backend)
+
+    def load_verification(self, backend: Optional[CPUBackend] = None):
+        from speechbrain.inference.speaker import SpeakerRecognition
+        verification = SpeakerRecognition.from_hparams(source="speechbrain/spkrec-ecapa-voxceleb", savedir=f"{self.intermediate_dir}/pretrained_models/spkrec-ecapa-voxceleb", run_opts={"device": self.device})
+        if backend is not None:
+            verification = backend.prepare_verification(verification)
+        return verification
+
+    def embed(self, samples, verification=None):
+        # samples are 16 kHz mono float32, e.g. a slice of self.audio
+        import torch
+        if verification is None:
+            verification = self.verification
+        with torch.no_grad():
+            return verification.encode_batch(torch.from_numpy(samples).unsqueeze(0), None, normalize=False)
+
+    def score(self, emb_x, emb_y, verification=None):
+        if verification is None:
+            verification = self.verification
+        return float(verification.similarity(emb_x, emb_y)[0])
+
+    def speaker_wav_path(self, speaker: str):
+        return os.path.join(self.intermediate_dir, "speakers/", f"{speaker}.wav")
+
+    def is_processed(self):
+        return os.path.exists(os.path.join(self.intermediate_dir, "speaker_info.json"))
+
+    @property
+    def audio(self):
+        if self._audio is None:
+            self._audio = self.audio_cache.load(self.video_file_path)
+            if self.denoise:
+                self._audio = self.audio_cache.load_derived(self._audio, f"denoised-{self.denoise_prop}", self._denoise)
+        return self._audio
+
+    def _denoise(self, samples):
+        import torch
+        from noisereduce.torchgate import TorchGate as TG
+        noisy_speech = torch.from_numpy(samples).unsqueeze(0).to(self.device)
+        # Create TorchGating instance
+        tg = TG(sr=SAMPLE_RATE, nonstationary=True, prop_decrease=self.denoise_prop).to(self.device)
+        # Apply Spectral Gate to noisy speech signal
+        with torch.no_grad():
+            enhanced_speech = tg(noisy_speech)
+        return enhanced_speech.squeeze(0).cpu().numpy()
+
+    def segment_path(self, seg_id):
+        return os.path.join(self.segment_dir, f"segment_{seg_id}.wav")
+
+    def segment_samples(self, seg_id):
+        if seg_id not in self.all_segment_info:
+            # Keys become strings once segment_info.json has been reloaded
+            seg_id = str(seg_id)
+        seg = self.all_segment_info[seg_id]
+        return self.audio.slice(seg["start"], seg["end"])
+
+    def reference_samples(self, speaker: str):
+        import numpy as np
+        ref_ids = self.all_speaker_info[speaker].get("ref_segment_ids")
+        if ref_ids is None:
+            # Outputs written before ref_segment_ids existed only have the segment_<id>.wav paths
+            ref_ids = []
+            for path in self.all_speaker_info[speaker]["ref_segments"]:
+                match = re.fullmatch(r"segment_(\d+)\.wav", os.path.basename(path))
+                ref_ids.append(int(match.group(1)) if match else None)
+        # Each reference segment is used once, even when several utterances matched it
+        seg_ids = []
+        for s_id in ref_ids:
+            if s_id is not None and s_id not in seg_ids:
+                seg_ids.append(s_id)
+        slices = [self.segment_samples(s_id) for s_id in seg_ids]
+        if not len(slices):
+            return None
+        return np.concatenate(slices)
     
+    def save_info(self):
+        json.dump(self.all_speaker_info, open(os.path.join(self.intermediate_dir, "speaker_info.json"), "w+"))
+        json.dump(self.all_segment_info, open(os.path.join(self.intermediate_dir, "segment_info.json"), "w+"))
+
     def update_best_speakers(self):
-        self.all_speaker_info = {}
+        # Re-assign segments from the cached speaker scores, e.g. after changing the threshold
+        for sp in self.all_speaker_info:
+            self.all_speaker_info[sp]["pred_segments"] = []
+            self.all_speaker_info[sp]["pred_utterances"] = []
         for s_id in self.all_segment_info:
+            if not self.all_segment_info[s_id].get("speaker_preds"):
+                continue
             sp, sc = self.all_segment_info[s_id]["speaker_preds"][0]
             if sc > self.verification_threshold:
                 self.all_speaker_info[sp]["pred_segments"].append((s_id, 
@@ -87,6 +195,7 @@ class FileProcessor:
                 self.all_speaker_info[sp]["pred_utterances"].append(self.all_segment_info[s_id]["text"])
 
     def write_speaker_videos(self):
+        from moviepy import VideoFileClip, concatenate_videoclips
         og_video_clip = VideoFileClip(self.video_file_path)
         for speaker in tqdm.tqdm(self.all_speaker_info):
             all_speaker_clips = []
@@ -95,48 +204,52 @@ class FileProcessor:
             fin_speaker_clip = concatenate_videoclips(all_speaker_clips)
             fin_speaker_clip.write_videofile(os.path.join(self.intermediate_dir, "final_merged_speakers/", f"{speaker}.mp4"))
     
+    def write_wav(self, path: str, samples):
+        import torch
+        import torchaudio
+        torchaudio.save(path, torch.from_numpy(samples).unsqueeze(0), SAMPLE_RATE)
+
     def process(self):
+        # Start from scratch, a forced re-run must not append to previously loaded results
+        self.all_speaker_info = self.initial_speaker_info()
+        self.all_segment_info = {"segments": {}}
         # Saving individual segments
-        results = transcribe_with_whisper(self.file_path, self.segment_dir)
+        results = transcribe_with_whisper(self.audio, self.segment_dir,
+                                          self.load_whisper(self.backend))
         json.dump(results, open(os.path.join(self.intermediate_dir, "whisper_results.json"), "w+"))
+        for seg in results["segments"]:
+            self.all_segment_info.update({
+                seg["id"]: {
+                    "path": self.segment_path(seg["id"]),
+                    "text": seg["text"],
+                    "start": seg["start"],
+                    "end": seg["end"],
+                    "speaker_preds": []
+                }
+            })
         # Go identify speaker segments using fuzzy string match
         for speaker in self.all_speaker_info:
             for utt in self.all_speaker_info[speaker]["ref_utterances"]:
                 utt_id = match_speaker_to_segments(results["segments"], utt)
-                utt_seg_path = os.path.join(self.segment_dir, f"segment_{utt_id}.wav")
-                self.all_speaker_info[speaker]["ref_segments"].append(utt_seg_path)
-        # Merge all the reference segments into one major segment
+                self.all_speaker_info[speaker]["ref_segments"].append(self.segment_path(utt_id))
+                self.all_speaker_info[speaker]["ref_segment_ids"].append(utt_id)
+        # Merge all the reference segments into one major segment, embedding each reference
+        # once instead of once per segment
+        speaker_embs = {}
         for speaker in self.all_speaker_info:
-            audio_clips = []
-            for seg_path in self.all_speaker_info[speaker]["ref_segments"]:
-                if os.path.exists(seg_path):
-                    audio_clips.append(AudioFileClip(seg_path))
-            if len(audio_clips):
-                merged_clip: AudioFileClip = concatenate_audioclips(audio_clips)
-                merged_path = os.path.join(self.intermediate_dir + "/", "speakers/", f"{speaker}.wav")
-                merged_clip.write_audiofile(merged_path)
-                merged_clip.close()
-            for clip in audio_clips:
-                clip.close()
+            ref_samples = self.reference_samples(speaker)
+            if ref_samples is not None:
+                self.write_wav(self.speaker_wav_path(speaker), ref_samples)
+                speaker_embs[speaker] = self.embed(ref_samples)
         # Iterate through each speaker and each segment
         for seg in tqdm.tqdm(results["segments"]):
-            seg_path = f"{self.segment_dir}/segment_{seg["id"]}.wav"
             seg_text = seg["text"]
-            self.all_segment_info.update({
-                seg["id"]: {
-                    "path": seg_path,
-                    "text": seg_text,
-                    "start": seg["start"],
-                    "end": seg["end"],
-                    "speaker_preds": []
-                }
-            })
             best_speaker, best_score = None, float("-inf")
             try:
-                for speaker in self.all_speaker_info:
+                seg_emb = self.embed(self.segment_samples(seg["id"]))
+                for speaker in speaker_embs:
                     # Verify the segment and try to find the best one
-                    speaker_path = os.path.join(self.intermediate_dir, "speakers/", f"{speaker}.wav")
-                    score, _ = self.verification.verify_files(seg_path, speaker_path)
+                    score = self.score(seg_emb, speaker_embs[speaker])
                     if score > best_score:
                         best_score = score
                         best_speaker = speaker
@@ -153,8 +266,7 @@ class FileProcessor:
         with open(transcript_path, "w+", encoding="utf-8") as f:
             f.write(results["text"])
         self.trans_text = results["text"]
-        json.dump(self.all_speaker_info, open(os.path.join(self.intermediate_dir, "speaker_info.json"), "w+"))
-        json.dump(self.all_segment_info, open(os.path.join(self.intermediate_dir, "segment_info.json"), "w+"))
+        self.save_info()
 
         # Merge clips that we think are spoken by the same speaker
         if self.write_video:
@@ -0,0 +1,133 @@
+import os
+from typing import Optional
+
+
+class CPUBackend:
+    """CPU inference settings for the Whisper and speaker verification models.
+
+    quantize: dynamic int8 quantization of Whisper's linear layers
+    export: None, "torchscript" or "onnx"; the Whisper encoder is exported once and cached in cache_dir,
+        with "torchscript" the ECAPA embedding model is traced and cached as well
+    num_threads / num_interop_threads: torch intra-op / inter-op thread pools, None keeps torch's default
+    """
+    def __init__(self, cache_dir: str, quantize: bool = True, export: Optional[str] = None,
+                 num_threads: Optional[int] = None, num_interop_threads: Optional[int] = 1):
+        if export not in (None, "torchscript", "onnx"):
+            raise ValueError(f"Unknown export format {export}, expected torchscript or onnx")
+        self.cache_dir = cache_dir
+        self.quantize = quantize
+        self.export = export
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self._threads_configured = False
+
+    def configure_threads(self):
+        if self._threads_configured:
+            return
+        import torch
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads is not None:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError:
+                # Can only be set before any inter-op parallel work has started
+                print(f"Could not set inter-op threads, keeping {torch.get_num_interop_threads()}")
+        self._threads_configured = True
+
+    def prepare_whisper(self, model, model_name: str):
+        import torch
+        import whisper
+        self.configure_threads()
+        model = model.cpu().eval()
+        if self.export == "onnx":
+            model.encoder = self._onnx_whisper_encoder(model, model_name)
+        if self.quantize:
+            # whisper.model.Linear only casts the weights to the input dtype, which is a
+            # no-op in fp32; turn it back into nn.Linear so it can be quantized.
+            for module in model.modules():
+                if type(module) is whisper.model.Linear:
+                    module.__class__ = torch.nn.Linear
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        if self.export == "torchscript":
+            model.encoder = self._torchscript_whisper_encoder(model, model_name)
+        return model
+
+    @property
+    def changes_verification(self):
+        # ECAPA_TDNN is built from Conv1d layers only, so dynamic quantization has nothing to act on
+        # and the speaker model stays fp32 eager (with the thread settings) unless it is traced
+        return self.export == "torchscript"
+
+    def prepare_verification(self, verification, model_name: str = "spkrec-ecapa-voxceleb"):
+        self.configure_threads()
+        if self.changes_verification:
+            verification.mods.embedding_model = self._torchscript_embedding_model(
+                verification.mods.embedding_model, model_name)
+        return verification
+
+    def _encoder_path(self, model_name: str, ext: str, suffix: str = ""):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, f"whisper-{model_name}-encoder{suffix}.{ext}")
+
+    def _example_mel(self, model):
+        import torch
+        import whisper
+        return torch.zeros(1, model.dims.n_mels, whisper.audio.N_FRAMES)
+
+    def _torchscript_whisper_encoder(self, model, model_name: str):
+        import torch
+        path = self._encoder_path(model_name, "pt", "-int8" if self.quantize else "")
+        if not os.path.exists(path):
+            with torch.no_grad():
+                traced = torch.jit.trace(model.encoder, self._example_mel(model))
+            torch.jit.save(traced, path)
+        return torch.jit.load(path, map_location="cpu")
+
+    def _torchscript_embedding_model(self, embedding_model, model_name: str):
+        import torch
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{model_name}-embedding.pt")
+        if not os.path.exists(path):
+            # Traced with one (batch 1, time, n_mels) example; the time axis stays dynamic
+            n_mels = embedding_model.blocks[0].conv.conv.in_channels
+            with torch.no_grad():
+                traced = torch.jit.trace(embedding_model.cpu().eval(), (torch.zeros(1, 200, n_mels), torch.ones(1)))
+            torch.jit.save(traced, path)
+        return torch.jit.load(path, map_location="cpu")
+
+    def _onnx_whisper_encoder(self, model, model_name: str):
+        import torch
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("export=\"onnx\" requires onnxruntime, run `pip install onnx onnxruntime`")
+        path = self._encoder_path(model_name, "onnx")
+        if not os.path.exists(path):
+            with torch.no_grad():
+                torch.onnx.export(model.encoder, self._example_mel(model), path,
+                                  input_names=["mel"], output_names=["audio_features"],
+                                  dynamic_axes={"mel": {0: "batch"}, "audio_features": {0: "batch"}})
+        if self.quantize:
+            quantized_path = self._encoder_path(model_name, "onnx", "-int8-matmul")
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                # Quantizing the convolutions as well turns them into ConvInteger, which is slower
+                # than fp32 on the CPU provider; the MatMuls are where int8 pays off
+                quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8, per_channel=True,
+                                 op_types_to_quantize=["MatMul"])
+            path = quantized_path
+        options = onnxruntime.SessionOptions()
+        if self.num_threads is not None:
+            options.intra_op_num_threads = self.num_threads
+        if self.num_interop_threads is not None:
+            options.inter_op_num_threads = self.num_interop_threads
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        class OnnxEncoder(torch.nn.Module):
+            def forward(self, mel):
+                audio_features = session.run(None, {"mel": mel.float().cpu().numpy()})[0]
+                return torch.from_numpy(audio_features)
+
+        return OnnxEncoder()
+
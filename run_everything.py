@@ -1,35 +1,192 @@
-import json
+import time
+_START = time.perf_counter()
 
-from file_processor import FileProcessor
-from evaluator import Evaluator
-from argparse import ArgumentParser
+import json
+import importlib
+from argparse import ArgumentParser, SUPPRESS
 import os
 
+# file_processor and evaluator are imported inside the commands; FileProcessor
+# itself only loads torch / speechbrain / whisper / moviepy when a stage needs them.
+
+HEAVY_MODULES = ["torch", "torchaudio", "moviepy", "noisereduce", "speechbrain.inference.speaker",
+                 "whisper", "pyannote.metrics.diarization", "jiwer"]
+
+
+def build_processor(config_file):
+    from file_processor import FileProcessor
+    config = json.load(open(config_file))
+    return FileProcessor(**config)
+
+
+def process(args):
+    fp = build_processor(args.config_file)
+    if args.force or not fp.is_processed():
+        fp.process()
+    return fp
+
+
+def rescore(args):
+    fp = build_processor(args.config_file)
+    if not fp.is_processed():
+        raise FileNotFoundError(f"{fp.intermediate_dir} has no speaker_info.json, run `process` first")
+    if args.verification_threshold is not None:
+        fp.verification_threshold = args.verification_threshold
+    fp.update_best_speakers()
+    fp.save_info()
+    print({s: len(fp.all_speaker_info[s]["pred_segments"]) for s in fp.all_speaker_info})
+
+
+def evaluate(args, fp=None):
+    from evaluator import Evaluator
+    if fp is None:
+        fp = build_processor(args.config_file)
+        if not fp.is_processed():
+            raise FileNotFoundError(f"{fp.intermediate_dir} has no speaker_info.json, run `process` first")
+    gt_segments_path = args.gt_path
+    if not os.path.exists(gt_segments_path):
+        raise FileNotFoundError(f"{gt_segments_path} does not exist")
+
+    gt_speaker_segs = json.load(open(gt_segments_path))
+
+    # Assuming we have a set of segments and corresponding speaker labels
+    eval = Evaluator(gt_speaker_segs, fp.all_segment_info, fp.trans_text)
+    eval_results = eval.evaluate()
+    print(eval_results)
+    json.dump(eval_results, open(args.output, "w+"))
+
+
+def render(args):
+    fp = build_processor(args.config_file)
+    if not fp.is_processed():
+        raise FileNotFoundError(f"{fp.intermediate_dir} has no speaker_info.json, run `process` first")
+    fp.write_speaker_videos()
+
+
+def bench(args):
+    # Everything is in seconds
+    timings = {"startup": time.perf_counter() - _START}
+    start = time.perf_counter()
+    fp = build_processor(args.config_file)
+    timings["build_processor"] = time.perf_counter() - start
+    imports = {}
+    for module in args.modules or HEAVY_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            imports[module] = time.perf_counter() - start
+        except ImportError:
+            imports[module] = None
+    timings["imports"] = imports
+    if args.load_models:
+        start = time.perf_counter()
+        fp.verification
+        timings["load_verification_model"] = time.perf_counter() - start
+        timings["device"] = fp.device
+    print(json.dumps(timings, indent=2))
+
+
+def compare_speaker_scores(fp, reference, max_segments):
+    # Score the processed segments with the reference (fp32) verifier and with fp.verification
+    speaker_embs = {}
+    for s in fp.all_speaker_info:
+        ref_samples = fp.reference_samples(s)
+        if ref_samples is not None:
+            speaker_embs[s] = (fp.embed(ref_samples, reference), fp.embed(ref_samples))
+    speakers = list(speaker_embs)
+    if not len(speakers):
+        return {"speaker_check": "skipped, no speaker reference segments available"}
+    deltas, flips = [], 0
+    seg_ids = [s_id for s_id, seg in fp.all_segment_info.items()
+               if "start" in seg and seg["end"] > seg["start"]][:max_segments]
+    for s_id in seg_ids:
+        seg_samples = fp.segment_samples(s_id)
+        ref_emb, emb = fp.embed(seg_samples, reference), fp.embed(seg_samples)
+        ref_scores = {s: fp.score(ref_emb, speaker_embs[s][0], reference) for s in speakers}
+        scores = {s: fp.score(emb, speaker_embs[s][1]) for s in speakers}
+        deltas.extend(abs(ref_scores[s] - scores[s]) for s in speakers)
+        ref_best, best = max(ref_scores, key=ref_scores.get), max(scores, key=scores.get)
+        if (ref_best, ref_scores[ref_best] > fp.verification_threshold) != (best, scores[best] > fp.verification_threshold):
+            flips += 1
+    if not len(deltas):
+        return {"speaker_check": "skipped, no segments to score"}
+    return {"score_delta_max": max(deltas),
+            "score_delta_mean": sum(deltas) / len(deltas),
+            "speaker_flips": flips,
+            "num_segments": len(seg_ids),
+            "speaker_flip_rate": flips / len(seg_ids)}
+
+
+def check_backend(args):
+    # Compare the configured cpu_backend against the fp32 eager models on the same audio
+    from jiwer import wer
+    fp = build_processor(args.config_file)
+    if fp.backend is None:
+        raise ValueError(f"{args.config_file} has no cpu_backend to check")
+    duration = fp.audio.duration
+
+    results = {}
+    transcripts = {}
+    # fp.device is always "cpu" when a cpu_backend is configured
+    models = {"backend": fp.load_whisper(fp.backend),
+              "fp32": fp.load_whisper()}
+    for name, model in models.items():
+        start = time.perf_counter()
+        transcripts[name] = model.transcribe(fp.audio.samples, word_timestamps=True)["text"]
+        results[f"rtf_{name}"] = (time.perf_counter() - start) / duration
+    results["speedup"] = results["rtf_fp32"] / results["rtf_backend"]
+    results["wer_vs_fp32"] = wer(transcripts["fp32"], transcripts["backend"])
+
+    if not fp.backend.changes_verification:
+        results["speaker_check"] = "skipped, the speaker model runs unchanged in fp32"
+    elif fp.is_processed():
+        results.update(compare_speaker_scores(fp, fp.load_verification(), args.max_segments))
+
+    results["within_tolerance"] = (results["wer_vs_fp32"] <= args.max_wer
+                                   and results.get("score_delta_max", 0.0) <= args.max_score_delta
+                                   and results.get("speaker_flip_rate", 0.0) <= args.max_flip_rate)
+    print(json.dumps(results, indent=2))
+    json.dump(results, open(os.path.join(fp.intermediate_dir, "backend_check.json"), "w+"))
+
+
 if __name__ == "__main__":
     parser = ArgumentParser()
-    parser.add_argument("--config_file", type=str)
+    parser.add_argument("--config_file", type=str, required=True)
+    # Running without a command processes the file (if needed) and optionally evaluates it
     parser.add_argument("--evaluate", action="store_true")
-    args = parser.parse_args()
-    config_file = json.load(open(args.config_file))
+    parser.add_argument("--gt_path", type=str, default=os.path.join("ground_truth_labels/", "speaker_gt_segments.json"))
+    parser.add_argument("--output", type=str, default="evaluation_results.json")
+    subparsers = parser.add_subparsers(dest="command")
 
-    fp = FileProcessor(**config_file)
-    if not os.path.exists(os.path.join(fp.intermediate_dir, "speaker_info.json")):
-        fp.process()
+    process_parser = subparsers.add_parser("process", help="transcribe and assign speakers to segments")
+    process_parser.add_argument("--force", action="store_true", help="re-run even if outputs already exist")
+
+    rescore_parser = subparsers.add_parser("rescore", help="re-assign speakers from cached scores")
+    rescore_parser.add_argument("--verification_threshold", type=float, default=None)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="compute DER / WER against the ground truth labels")
+    # SUPPRESS keeps the top-level values when these are not given after the command
+    evaluate_parser.add_argument("--gt_path", type=str, default=SUPPRESS)
+    evaluate_parser.add_argument("--output", type=str, default=SUPPRESS)
+    subparsers.add_parser("render", help="write the per-speaker videos")
+
+    bench_parser = subparsers.add_parser("bench", help="time startup, imports and model loading")
+    bench_parser.add_argument("--modules", nargs="*", default=None)
+    bench_parser.add_argument("--load_models", action="store_true")
+
+    check_parser = subparsers.add_parser("check_backend", help="compare cpu_backend against the fp32 models (WER, score deltas, real-time factor)")
+    check_parser.add_argument("--max_segments", type=int, default=50)
+    check_parser.add_argument("--max_wer", type=float, default=0.05)
+    check_parser.add_argument("--max_score_delta", type=float, default=0.05)
+    check_parser.add_argument("--max_flip_rate", type=float, default=0.05,
+                              help="highest allowed fraction of segments whose assigned speaker changes")
+    args = parser.parse_args()
 
-    # Compare speaker speaking duration
-
-    # Assume speaker label file exists
-
-    if args.evaluate:
-        gt_segments_path = os.path.join("ground_truth_labels/", "speaker_gt_segments.json")
-        if not os.path.exists(gt_segments_path):
-            raise FileNotFoundError(f"{gt_segments_path} does not exist")
-        
-        gt_speaker_segs = json.load(open(gt_segments_path))
-        
-        
-        # Assuming we have a set of segments and corresponding speaker labels
-        eval = Evaluator(gt_speaker_segs, fp.all_segment_info, fp.trans_text)
-        eval_results = eval.evaluate()
-        print(eval_results)
-        json.dump(eval_results, open("evaluation_results.json", "w+"))
+    if args.command is None:
+        args.force = False
+        fp = process(args)
+        if args.evaluate:
+            evaluate(args, fp)
+    else:
+        {"process": process, "rescore": rescore, "evaluate": evaluate,
+         "render": render, "bench": bench, "check_backend": check_backend}[args.command](args)
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# file_processor imports its siblings as end_to_end.*, the name this directory has upstream
+if "end_to_end" not in sys.modules:
+    package = types.ModuleType("end_to_end")
+    package.__path__ = [ROOT]
+    sys.modules["end_to_end"] = package
+
+
+SEGMENTS = [
+    {"id": 0, "text": " Nope, still easy to manage", "start": 0.0, "end": 1.0},
+    {"id": 1, "text": " Push one of epi", "start": 1.0, "end": 2.0},
+    {"id": 2, "text": " Okay, checking a pulse", "start": 2.0, "end": 3.0},
+]
+
+
+def fake_transcribe(audio, segment_dir, model=None):
+    return {"text": "".join(s["text"] for s in SEGMENTS), "segments": [dict(s) for s in SEGMENTS]}
+
+
+@pytest.fixture
+def make_processor(tmp_path, monkeypatch):
+    import file_processor
+    from file_processor import FileProcessor
+    from audio_cache import PCMAudio, SAMPLE_RATE
+
+    # Stub out Whisper, the wav writer and ECAPA: a segment's "embedding" is its mean sample
+    monkeypatch.setattr(file_processor, "transcribe_with_whisper", fake_transcribe)
+    monkeypatch.setattr(file_processor, "load_whisper_model", lambda **kwargs: None)
+    monkeypatch.setattr(FileProcessor, "write_wav", lambda self, path, samples: None)
+    monkeypatch.setattr(FileProcessor, "embed", lambda self, samples, verification=None: float(samples.mean()))
+    monkeypatch.setattr(FileProcessor, "score", lambda self, x, y, verification=None: -abs(x - y))
+
+    video_path = tmp_path / "video.mp4"
+    video_path.touch()
+    speaker_dict_path = tmp_path / "speaker_dict.json"
+    json.dump({"A": ["still easy to manage", "Nope, still easy"], "B": ["push one of epi"]},
+              open(speaker_dict_path, "w+"))
+    samples = np.concatenate([np.full(SAMPLE_RATE, v, dtype=np.float32) for v in (0.1, 0.5, 0.12)])
+
+    def make():
+        fp = FileProcessor(str(video_path), str(tmp_path / "segments"), str(tmp_path / "intermediate"),
+                           str(speaker_dict_path), verification_threshold=-0.5, write_video=False,
+                           audio_cache_dir=str(tmp_path / "cache"))
+        fp._audio = PCMAudio(None, "test", samples, SAMPLE_RATE)
+        return fp
+    return make
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+import audio_cache
+from audio_cache import AudioCache, SAMPLE_RATE
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    # 2 s of a stereo 44.1 kHz tone in a video container
+    imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+    path = str(tmp_path_factory.mktemp("clip") / "clip.mp4")
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-nostdin", "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100:duration=2",
+                    "-f", "lavfi", "-i", "color=c=black:s=64x64:d=2", "-shortest",
+                    "-ac", "2", "-c:a", "aac", "-c:v", "libx264", path], check=True)
+    return path
+
+
+def test_load_decodes_to_16k_mono_memmap(clip, tmp_path):
+    audio = AudioCache(str(tmp_path)).load(clip)
+    assert isinstance(audio.samples, np.memmap)
+    assert audio.samples.dtype == np.float32
+    assert audio.samples.ndim == 1
+    assert audio.sample_rate == SAMPLE_RATE
+    assert abs(audio.duration - 2.0) < 0.1
+    assert np.abs(audio.samples).max() > 0.01
+
+
+def test_second_load_hits_cache(clip, tmp_path, monkeypatch):
+    first = AudioCache(str(tmp_path)).load(clip)
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("ffmpeg should not run on a cache hit")
+    monkeypatch.setattr(audio_cache.subprocess, "run", no_decode)
+    second = AudioCache(str(tmp_path)).load(clip)
+    assert second.key == first.key
+    assert np.array_equal(second.samples, first.samples)
+
+
+def test_hash_index_skips_rehashing_unchanged_files(clip, tmp_path, monkeypatch):
+    key = AudioCache(str(tmp_path)).load(clip).key
+    hashed = []
+    monkeypatch.setattr(audio_cache, "file_hash", lambda path: hashed.append(path) or key)
+
+    assert AudioCache(str(tmp_path)).load(clip).key == key
+    assert hashed == []
+    # A modified file (new mtime) is hashed again
+    stat = os.stat(clip)
+    os.utime(clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert AudioCache(str(tmp_path)).load(clip).key == key
+    assert hashed == [os.path.abspath(clip)]
+
+
+def test_slice_is_a_view(clip, tmp_path):
+    audio = AudioCache(str(tmp_path)).load(clip)
+    segment = audio.slice(0.5, 1.0)
+    assert len(segment) == SAMPLE_RATE // 2
+    assert np.shares_memory(segment, audio.samples)
+
+
+def test_derived_entries(clip, tmp_path):
+    cache = AudioCache(str(tmp_path))
+    audio = cache.load(clip)
+
+    half = cache.load_derived(audio, "half", lambda samples: samples * 0.5)
+    assert half.key == f"{audio.key}-half"
+    assert np.allclose(half.samples, audio.samples * 0.5)
+    assert json.load(open(os.path.join(str(tmp_path), f"{audio.key}-half.json")))["sample_rate"] == SAMPLE_RATE
+
+    pytest.importorskip("torchaudio")
+    assert audio.resampled(SAMPLE_RATE) is audio
+    low = audio.resampled(8000)
+    assert low.key == f"{audio.key}-8000hz"
+    assert low.sample_rate == 8000
+    assert abs(low.duration - audio.duration) < 0.01
+    assert json.load(open(os.path.join(str(tmp_path), f"{audio.key}-8000hz.json")))["sample_rate"] == 8000
@@ -0,0 +1,37 @@
+import json
+import os
+
+from audio_cache import SAMPLE_RATE
+
+def read_outputs(intermediate_dir):
+    return {name: open(os.path.join(intermediate_dir, name)).read()
+            for name in ("speaker_info.json", "segment_info.json", "transcript.txt")}
+
+
+def test_process_twice_gives_identical_output(make_processor):
+    fp = make_processor()
+    fp.process()
+    first = read_outputs(fp.intermediate_dir)
+    speaker_info = json.loads(first["speaker_info.json"])
+    assert [s[0] for s in speaker_info["A"]["pred_segments"]] == [0, 2]
+    assert [s[0] for s in speaker_info["B"]["pred_segments"]] == [1]
+
+    fp.process()
+    assert read_outputs(fp.intermediate_dir) == first
+
+    # Same as `process --force`: the previous results are loaded from disk first
+    fp = make_processor()
+    fp.process()
+    assert read_outputs(fp.intermediate_dir) == first
+
+
+def test_reference_uses_each_segment_once(make_processor):
+    fp = make_processor()
+    fp.process()
+    # Both of A's utterances match segment 0
+    assert fp.all_speaker_info["A"]["ref_segment_ids"] == [0, 0]
+    assert len(fp.reference_samples("A")) == SAMPLE_RATE
+
+    fp = make_processor()
+    assert len(fp.reference_samples("A")) == SAMPLE_RATE
+    assert len(fp.reference_samples("B")) == SAMPLE_RATE
@@ -0,0 +1,78 @@
+import copy
+import types
+
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+
+from inference_backend import CPUBackend
+
+
+@pytest.fixture(scope="module")
+def tiny_whisper():
+    # Random weights with tiny-model dimensions, enough to exercise the export paths
+    torch.manual_seed(0)
+    dims = whisper.model.ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=384, n_audio_head=6,
+                                         n_audio_layer=4, n_vocab=51865, n_text_ctx=448, n_text_state=384,
+                                         n_text_head=6, n_text_layer=4)
+    model = whisper.model.Whisper(dims).eval()
+    mel = torch.randn(1, 80, whisper.audio.N_FRAMES)
+    with torch.no_grad():
+        features = model.encoder(mel)
+    return model, mel, features
+
+
+def encode(model, mel):
+    with torch.no_grad():
+        return model.encoder(mel)
+
+
+def test_unknown_export_raises(tmp_path):
+    with pytest.raises(ValueError):
+        CPUBackend(str(tmp_path), export="tflite")
+
+
+@pytest.mark.parametrize("quantize,export", [(True, None), (False, "torchscript"), (True, "torchscript"),
+                                             (False, "onnx"), (True, "onnx")])
+def test_prepare_whisper(tiny_whisper, tmp_path, monkeypatch, quantize, export):
+    if export == "onnx":
+        pytest.importorskip("onnxruntime")
+    model, mel, features = tiny_whisper
+    backend = CPUBackend(str(tmp_path), quantize=quantize, export=export)
+    prepared = backend.prepare_whisper(copy.deepcopy(model), "tiny-random")
+    prepared_features = encode(prepared, mel)
+    # int8 weights move the features a little, fp32 exports must reproduce them
+    atol = 0.2 if quantize else 1e-4
+    assert torch.allclose(prepared_features, features, atol=atol)
+    if export is None:
+        return
+
+    def no_export(*args, **kwargs):
+        raise AssertionError("the cached encoder should have been reused")
+    monkeypatch.setattr(torch.jit, "trace", no_export)
+    monkeypatch.setattr(torch.onnx, "export", no_export)
+    reloaded = CPUBackend(str(tmp_path), quantize=quantize, export=export).prepare_whisper(
+        copy.deepcopy(model), "tiny-random")
+    assert torch.allclose(encode(reloaded, mel), prepared_features)
+
+
+def test_prepare_verification_traces_ecapa(tmp_path, monkeypatch):
+    ecapa = pytest.importorskip("speechbrain.lobes.models.ECAPA_TDNN")
+    torch.manual_seed(0)
+    embedding_model = ecapa.ECAPA_TDNN(80).eval()
+    verification = types.SimpleNamespace(mods=types.SimpleNamespace(embedding_model=embedding_model))
+    assert CPUBackend(str(tmp_path)).prepare_verification(verification).mods.embedding_model is embedding_model
+
+    CPUBackend(str(tmp_path), export="torchscript").prepare_verification(verification)
+    # Traced at one length, the time axis must stay dynamic
+    feats, lens = torch.randn(1, 431, 80), torch.ones(1)
+    with torch.no_grad():
+        assert torch.allclose(verification.mods.embedding_model(feats, lens), embedding_model(feats, lens))
+
+    def no_trace(*args, **kwargs):
+        raise AssertionError("the cached embedding model should have been reused")
+    monkeypatch.setattr(torch.jit, "trace", no_trace)
+    verification.mods.embedding_model = embedding_model
+    CPUBackend(str(tmp_path), export="torchscript").prepare_verification(verification)
+    assert verification.mods.embedding_model is not embedding_model
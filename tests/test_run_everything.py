@@ -0,0 +1,41 @@
+import json
+import os
+
+from run_everything import compare_speaker_scores
+from audio_cache import SAMPLE_RATE
+
+
+def rewrite_speaker_info(fp, update):
+    # Simulate outputs written before ref_segment_ids existed
+    path = os.path.join(fp.intermediate_dir, "speaker_info.json")
+    speaker_info = json.load(open(path))
+    for info in speaker_info.values():
+        del info["ref_segment_ids"]
+        update(info)
+    json.dump(speaker_info, open(path, "w+"))
+
+
+def test_legacy_outputs_rebuild_reference_from_paths(make_processor):
+    fp = make_processor()
+    fp.process()
+    rewrite_speaker_info(fp, lambda info: None)
+
+    fp = make_processor()
+    assert len(fp.reference_samples("A")) == SAMPLE_RATE
+    assert len(fp.reference_samples("B")) == SAMPLE_RATE
+    results = compare_speaker_scores(fp, object(), max_segments=50)
+    assert results["score_delta_max"] == 0.0
+    assert results["speaker_flips"] == 0
+    assert results["num_segments"] == 3
+
+
+def test_no_speaker_references_skips_score_check(make_processor):
+    fp = make_processor()
+    fp.process()
+    rewrite_speaker_info(fp, lambda info: info.update(ref_segments=[]))
+
+    fp = make_processor()
+    assert fp.reference_samples("A") is None
+    results = compare_speaker_scores(fp, object(), max_segments=50)
+    assert "score_delta_max" not in results
+    assert results["speaker_check"].startswith("skipped")
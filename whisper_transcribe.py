@@ -1,18 +1,26 @@
-import whisper
-import torchaudio 
 import os
-from moviepy import VideoFileClip
 import tqdm
 
-def transcribe_with_whisper(file_path: str, segment_dir: str):
-    signal, fs = torchaudio.load(file_path)
-    
-    model = whisper.load_model("turbo")
-    result = model.transcribe(file_path, word_timestamps=True)
+def load_whisper_model(model_name: str = "turbo", device=None, backend=None):
+    import whisper
+    if backend is not None:
+        device = "cpu"
+    model = whisper.load_model(model_name, device=device)
+    if backend is not None:
+        model = backend.prepare_whisper(model, model_name)
+    return model
+
+def transcribe_with_whisper(audio, segment_dir: str, model=None):
+    # audio is an audio_cache.PCMAudio; Whisper and the segment files both read from its samples
+    import torch
+    import torchaudio
+    import whisper
+
+    if model is None:
+        model = load_whisper_model()
+    result = model.transcribe(audio.resampled(whisper.audio.SAMPLE_RATE).samples, word_timestamps=True)
     for i, segment in tqdm.tqdm(enumerate(result["segments"])):
-        start, end = int(segment['start'] * fs), int(segment['end'] * fs)
-        segment_signal = signal[:, start: end]
+        segment_signal = torch.from_numpy(audio.slice(segment['start'], segment['end'])).unsqueeze(0)
         segment_path = f"{segment_dir}/segment_{i}.wav"
-        torchaudio.save(segment_path, segment_signal, fs)
+        torchaudio.save(segment_path, segment_signal, audio.sample_rate)
     return result
-        
\ No newline at end of file